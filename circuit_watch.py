@@ -1,38 +1,59 @@
-from datetime import datetime
+import functools
+import inspect
+import math
+import threading
 import time
-from enum import Enum
-from collections import deque
+from enum import IntEnum
 import random
 from typing import List
 
-class CircuitState(Enum):
-    OPEN_STATE = "OPEN_STATE"
-    CLOSED_STATE = "CLOSED_STATE"
-    HALF_OPEN_STATE = "HALF_OPEN_STATE"
+class CircuitState(IntEnum):
+    OPEN_STATE = 1
+    CLOSED_STATE = 2
+    HALF_OPEN_STATE = 3
 
 
-class SlidingWindowType(Enum):
-    COUNT_BASED = "COUNT_BASED"
-    TIME_BASED = "TIME_BASED"
+class SlidingWindowType(IntEnum):
+    COUNT_BASED = 1
+    TIME_BASED = 2
 
 
 class CBConstants(object):
-    DEFAULT_SLIDING_WINDOW_TYPE = SlidingWindowType.COUNT_BASED.value
+    DEFAULT_SLIDING_WINDOW_TYPE = SlidingWindowType.COUNT_BASED
     DEFAULT_COUNT_BASED_WINDOW_SIZE = 2
     DEFAULT_TIME_BASED_WINDOW_SIZE = 60
+    DEFAULT_TIME_WINDOW_BUCKETS = 10
     DEFAULT_FAILURE_RATE = 1.0
     DEFAULT_OPEN_STATE_DURATION = 10.0
     DEFAULT_HALF_OPEN_STATE_CALLS = 1
     DEFAULT_HALF_OPEN_STATE_DURATION = 0
 
 
-class CallDetail(object):
-    def __init__(self, status: bool):
-        self.status = status
-        self.timestamp = datetime.utcnow()
-
-
 class CircuitStorage(object):
+    __slots__ = (
+        "sliding_window_type",
+        "count_based_window_size",
+        "time_based_window_size",
+        "failure_rate",
+        "slow_call_duration",
+        "open_state_duration",
+        "half_open_state_calls_threshold",
+        "half_open_state_duration",
+        "call_mask",
+        "call_count",
+        "fail_counter",
+        "window_mask",
+        "fail_threshold",
+        "bucket_count",
+        "bucket_duration",
+        "bucket_success",
+        "bucket_failure",
+        "bucket_ids",
+        "window_start_time",
+        "half_open_state_total_calls",
+        "circuit_state",
+    )
+
     def __init__(
         self,
         sliding_window_type: SlidingWindowType = None,
@@ -52,13 +73,32 @@ class CircuitStorage(object):
         self.open_state_duration = open_state_duration or CBConstants.DEFAULT_OPEN_STATE_DURATION
         self.half_open_state_calls_threshold = half_open_state_calls_threshold or CBConstants.DEFAULT_HALF_OPEN_STATE_CALLS
         self.half_open_state_duration = half_open_state_duration or CBConstants.DEFAULT_HALF_OPEN_STATE_DURATION
-        self.total_calls = deque()
+        self.call_mask = 0
+        self.call_count = 0
+        self.fail_counter = 0
+        self.window_mask = (1 << self.count_based_window_size) - 1
+        self.fail_threshold = max(
+            1, math.ceil(self.failure_rate * self.count_based_window_size)
+        )
+        self.bucket_count = CBConstants.DEFAULT_TIME_WINDOW_BUCKETS
+        self.bucket_duration = self.time_based_window_size / self.bucket_count
+        self.bucket_success = [0] * self.bucket_count
+        self.bucket_failure = [0] * self.bucket_count
+        self.bucket_ids = [-1] * self.bucket_count
         self.window_start_time = None
         self.half_open_state_total_calls = 0
         self.circuit_state = CircuitState.CLOSED_STATE
 
 
 class CircuitBreaker(object):
+    __slots__ = (
+        "last_failure_time",
+        "listeners",
+        "_has_listeners",
+        "_lock",
+        "_storage_state",
+    )
+
     def __init__(
         self,
         sliding_window_type: SlidingWindowType = None,
@@ -69,10 +109,12 @@ class CircuitBreaker(object):
         half_open_state_calls_threshold: int = None,
         half_open_state_duration: float = None,
         open_state_duration: float = None,
-        listeners: list = []
+        listeners: list = None
     ):
         self.last_failure_time = None
-        self.listeners = listeners
+        self.listeners = tuple(listeners) if listeners else ()
+        self._has_listeners = bool(self.listeners)
+        self._lock = threading.Lock()
         self._storage_state = CircuitStorage(
             sliding_window_type=sliding_window_type,
             count_based_window_size=count_based_window_size,
@@ -85,48 +127,93 @@ class CircuitBreaker(object):
         )
 
     def reset_calls(self):
-        self._storage_state.total_calls.clear()
+        with self._lock:
+            self._storage_state.call_mask = 0
+            self._storage_state.call_count = 0
+            self._storage_state.fail_counter = 0
+            for index in range(self._storage_state.bucket_count):
+                self._storage_state.bucket_success[index] = 0
+                self._storage_state.bucket_failure[index] = 0
+                self._storage_state.bucket_ids[index] = -1
 
     def set_circuit_breaker_state(self, state: CircuitState):
-        prev_state = self._storage_state.circuit_state
-        self._storage_state.circuit_state = state
-        if self.listeners:
+        with self._lock:
+            prev_state = self._storage_state.circuit_state
+            self._storage_state.circuit_state = state
+        if self._has_listeners:
             for listener in self.listeners:
                 listener.state_change(self, prev_state, state)
 
     def update_last_failure_time(self):
-        self.last_failure_time = datetime.utcnow()
+        self.last_failure_time = time.monotonic()
 
     def update_circuit_state(self, updated_circuit_state: CircuitState):
-        self._storage_state.circuit_state = updated_circuit_state
+        with self._lock:
+            self._storage_state.circuit_state = updated_circuit_state
 
     def check_if_max_fails_reached(self):
+        if self._storage_state.sliding_window_type == SlidingWindowType.TIME_BASED:
+            return self.check_if_max_time_based_fails_reached()
+        return (
+            self._storage_state.call_count
+            >= self._storage_state.count_based_window_size
+            and self._storage_state.fail_counter
+            >= self._storage_state.fail_threshold
+        )
+
+    def check_if_max_time_based_fails_reached(self):
+        storage = self._storage_state
+        current_slot = int(time.monotonic() / storage.bucket_duration)
+        total_calls = 0
         fail_counter = 0
-        total_calls = len(self._storage_state.total_calls)
-        max_fails_reached = total_calls >= self._storage_state.count_based_window_size
-        if max_fails_reached:
-            for call in self._storage_state.total_calls:
-                fail_counter += 0 if call.status else 1
-            max_fails_reached = (
-                fail_counter / total_calls
-            ) >= self._storage_state.failure_rate
-        return max_fails_reached
+        for index in range(storage.bucket_count):
+            if current_slot - storage.bucket_ids[index] < storage.bucket_count:
+                total_calls += (
+                    storage.bucket_success[index] + storage.bucket_failure[index]
+                )
+                fail_counter += storage.bucket_failure[index]
+        return (
+            total_calls >= storage.count_based_window_size
+            and (fail_counter / total_calls) >= storage.failure_rate
+        )
 
     def check_if_open_state_duration_elapsed(self):
         return (
-            datetime.utcnow() - self.last_failure_time
-        ).seconds >= self._storage_state.open_state_duration
-
-    def update_total_calls_details(self):
-        while (
-            len(self._storage_state.total_calls)
-            > self._storage_state.count_based_window_size
-        ):
-            self._storage_state.total_calls.popleft()
+            time.monotonic() - self.last_failure_time
+        ) >= self._storage_state.open_state_duration
 
     def add_call_detail(self, status: bool):
-        self._storage_state.total_calls.append(CallDetail(status))
-        self.update_total_calls_details()
+        if self._storage_state.sliding_window_type == SlidingWindowType.TIME_BASED:
+            self.add_time_based_call_detail(status)
+            return
+        bit = 0 if status else 1
+        with self._lock:
+            evicted = (
+                self._storage_state.call_mask
+                >> (self._storage_state.count_based_window_size - 1)
+            ) & 1
+            self._storage_state.call_mask = (
+                (self._storage_state.call_mask << 1) | bit
+            ) & self._storage_state.window_mask
+            self._storage_state.fail_counter += bit - evicted
+            self._storage_state.call_count = min(
+                self._storage_state.call_count + 1,
+                self._storage_state.count_based_window_size,
+            )
+
+    def add_time_based_call_detail(self, status: bool):
+        storage = self._storage_state
+        slot = int(time.monotonic() / storage.bucket_duration)
+        index = slot % storage.bucket_count
+        with self._lock:
+            if storage.bucket_ids[index] != slot:
+                storage.bucket_ids[index] = slot
+                storage.bucket_success[index] = 0
+                storage.bucket_failure[index] = 0
+            if status:
+                storage.bucket_success[index] += 1
+            else:
+                storage.bucket_failure[index] += 1
 
     def check_if_execution_time_breached(self, start_time, end_time):
         if self._storage_state.slow_call_duration is not None:
@@ -134,10 +221,12 @@ class CircuitBreaker(object):
                 raise CircuitExecutionTimeBreachedException
 
     def increment_half_open_state_success_calls(self):
-        self._storage_state.half_open_state_total_calls += 1
+        with self._lock:
+            self._storage_state.half_open_state_total_calls += 1
 
     def reset_half_open_state_calls_counter(self):
-        self._storage_state.half_open_state_total_calls = 0
+        with self._lock:
+            self._storage_state.half_open_state_total_calls = 0
 
     def check_half_open_call_success(self):
         return (
@@ -146,50 +235,126 @@ class CircuitBreaker(object):
         )
 
     def get_circuit_state(self):
-        return {
-            CircuitState.OPEN_STATE: CircuitOpenState,
-            CircuitState.CLOSED_STATE: CircuitCloseState,
-            CircuitState.HALF_OPEN_STATE: CircuitHalfOpenState,
-        }.get(self._storage_state.circuit_state)
+        return _STATE_CLASSES[self._storage_state.circuit_state]
 
     def handle_before_call(self):
-        circuit_state = self.get_circuit_state()(self)
-        circuit_state.before_call()
+        if self._storage_state.circuit_state is CircuitState.OPEN_STATE:
+            if self.check_if_open_state_duration_elapsed():
+                self.set_circuit_breaker_state(CircuitState.HALF_OPEN_STATE)
+            else:
+                raise CircuitOpenException
 
     def handle_success(self):
-        circuit_state = self.get_circuit_state()(self)
-        circuit_state.on_success()
+        if self._storage_state.circuit_state is CircuitState.HALF_OPEN_STATE:
+            self.increment_half_open_state_success_calls()
+            if self.check_half_open_call_success():
+                self.set_circuit_breaker_state(CircuitState.CLOSED_STATE)
+                self.reset_calls()
+                self.reset_half_open_state_calls_counter()
+        else:
+            self.add_call_detail(True)
+            if self._has_listeners:
+                for listener in self.listeners:
+                    listener.success(self)
 
     def handle_failure(self, exc: Exception):
-        circuit_state = self.get_circuit_state()(self)
-        circuit_state.on_failure(exc)
+        state = self._storage_state.circuit_state
+        if state is CircuitState.CLOSED_STATE:
+            self.add_call_detail(False)
+            self.update_last_failure_time()
+            if self.check_if_max_fails_reached():
+                self.set_circuit_breaker_state(CircuitState.OPEN_STATE)
+            if self._has_listeners:
+                for listener in self.listeners:
+                    listener.failure(self, exc)
+        elif state is CircuitState.HALF_OPEN_STATE:
+            self.set_circuit_breaker_state(CircuitState.OPEN_STATE)
+            self.update_last_failure_time()
+            self.reset_half_open_state_calls_counter()
 
     def circuit_close(self):
-        self._storage_state.circuit_state = CircuitState.CLOSED_STATE
+        self.update_circuit_state(CircuitState.CLOSED_STATE)
 
     def circuit_open(self):
-        self._storage_state.circuit_state = CircuitState.OPEN_STATE
-    
+        self.update_circuit_state(CircuitState.OPEN_STATE)
+
     def circuit_half_open(self):
-        self._storage_state.circuit_state = CircuitState.HALF_OPEN_STATE
+        self.update_circuit_state(CircuitState.HALF_OPEN_STATE)
 
     def __call__(self, func):
-        def wrapper(*args, **kwargs):
-            self.handle_before_call()
-            try:
-                start_time = time.time()
-                result = func(*args, **kwargs)
-                self.check_if_execution_time_breached(start_time, time.time())
-                self.handle_success()
-                return result
-            except Exception as cbe:
-                self.handle_failure(cbe)
-                raise
+        handle_before_call = self.handle_before_call
+        handle_success = self.handle_success
+        handle_failure = self.handle_failure
+        monotonic = time.monotonic
+        slow_call_duration = self._storage_state.slow_call_duration
+
+        if inspect.iscoroutinefunction(func):
+            if slow_call_duration is None:
+
+                @functools.wraps(func)
+                async def wrapper(*args, **kwargs):
+                    handle_before_call()
+                    try:
+                        result = await func(*args, **kwargs)
+                        handle_success()
+                        return result
+                    except Exception as cbe:
+                        handle_failure(cbe)
+                        raise
+
+            else:
+
+                @functools.wraps(func)
+                async def wrapper(*args, **kwargs):
+                    handle_before_call()
+                    try:
+                        start_time = monotonic()
+                        result = await func(*args, **kwargs)
+                        if (monotonic() - start_time) >= slow_call_duration:
+                            raise CircuitExecutionTimeBreachedException
+                        handle_success()
+                        return result
+                    except Exception as cbe:
+                        handle_failure(cbe)
+                        raise
+
+            return wrapper
+
+        if slow_call_duration is None:
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                handle_before_call()
+                try:
+                    result = func(*args, **kwargs)
+                    handle_success()
+                    return result
+                except Exception as cbe:
+                    handle_failure(cbe)
+                    raise
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                handle_before_call()
+                try:
+                    start_time = monotonic()
+                    result = func(*args, **kwargs)
+                    if (monotonic() - start_time) >= slow_call_duration:
+                        raise CircuitExecutionTimeBreachedException
+                    handle_success()
+                    return result
+                except Exception as cbe:
+                    handle_failure(cbe)
+                    raise
 
         return wrapper
 
 
 class CircuitBreakerState(object):
+    __slots__ = ("circuit_breaker",)
+
     def __init__(self, cb: CircuitBreaker):
         self.circuit_breaker = cb
 
@@ -209,6 +374,8 @@ class CircuitBreakerState(object):
 
 
 class CircuitCloseState(CircuitBreakerState):
+    __slots__ = ()
+
     def __init__(self, cb: CircuitBreaker):
         super(CircuitCloseState, self).__init__(cb)
 
@@ -221,6 +388,8 @@ class CircuitCloseState(CircuitBreakerState):
 
 
 class CircuitOpenState(CircuitBreakerState):
+    __slots__ = ()
+
     def __init__(self, cb: CircuitBreaker):
         super(CircuitOpenState, self).__init__(cb)
 
@@ -235,6 +404,8 @@ class CircuitOpenState(CircuitBreakerState):
 
 
 class CircuitHalfOpenState(CircuitBreakerState):
+    __slots__ = ()
+
     def __init__(self, cb: CircuitBreaker):
         super(CircuitHalfOpenState, self).__init__(cb)
 
@@ -253,6 +424,14 @@ class CircuitHalfOpenState(CircuitBreakerState):
     def before_call(self):
         pass
 
+
+_STATE_CLASSES = {
+    CircuitState.OPEN_STATE: CircuitOpenState,
+    CircuitState.CLOSED_STATE: CircuitCloseState,
+    CircuitState.HALF_OPEN_STATE: CircuitHalfOpenState,
+}
+
+
 class CircuitBreakerListener(object):
     def success(self, cb: CircuitBreaker):
         pass